@@ -1,7 +1,12 @@
+import asyncio
 import atexit
+import collections
+import dataclasses
+import functools
+import logging
 import os
-import queue
 import re
+import selectors
 import shlex
 import shutil
 import signal
@@ -13,36 +18,142 @@ import traceback
 
 from mcp.server.fastmcp import FastMCP
 
+try:
+    import tomllib  # Python 3.11+
+except ModuleNotFoundError:
+    tomllib = None
+
 # Initialize FastMCP server
 mcp = FastMCP("mcp-pdb")
 
-# --- Global Variables ---
-pdb_process = None
-pdb_output_queue = queue.Queue()
-pdb_running = False
-current_file = None           # Absolute path of the file being debugged
-current_project_root = None # Root directory of the project being debugged
-current_args = ""             # Additional args passed to the script/pytest
-current_use_pytest = False    # Flag indicating if pytest was used
-breakpoints = {}              # Tracks breakpoints: {abs_file_path: {line_num: {command_str, bp_number}}}
-output_thread = None          # Thread object for reading output
+# Diagnostics go through logging, never print(): stdout carries the MCP stdio transport.
+# FastMCP routes records to stderr at FASTMCP_LOG_LEVEL (INFO by default; DEBUG shows every step).
+logger = logging.getLogger(__name__)
+
+# --- Session State ---
+@dataclasses.dataclass(slots=True)
+class PdbSession:
+    """State of the debugging session, shared by all tools.
+
+    Tool calls are serialized on lock; output_blocks/prompt_ready/output_eof are
+    replaced per pdb process and handed to its reader thread. Slotted, so every
+    field access is a fixed-offset lookup and a misspelt attribute raises.
+    """
+    process: subprocess.Popen | None = None
+    stdin_fd: int | None = None   # Raw fd of process.stdin; commands go straight to it via os.write
+    output_blocks: collections.deque = dataclasses.field(default_factory=collections.deque) # Raw runs of complete lines (bytes) from pdb's stdout, oldest first
+    prompt_ready: threading.Event = dataclasses.field(default_factory=threading.Event)   # Set by the reader when queued output includes a prompt
+    output_eof: threading.Event = dataclasses.field(default_factory=threading.Event)     # Set by the reader once pdb's stdout is exhausted
+    running: bool = False
+    file: str | None = None       # Absolute path of the file being debugged
+    project_root: str | None = None # Root directory of the project being debugged
+    args: str = ""                # Additional args passed to the script/pytest
+    use_pytest: bool = False      # Flag indicating if pytest was used
+    breakpoints: dict = dataclasses.field(default_factory=dict) # Tracks breakpoints: {(abs_file_path, line_num): bp_number}, kept in key order
+    output_thread: threading.Thread | None = None # Thread object for reading output
+    reader_stop_fd: int | None = None # Write end of the pipe that tells the reader thread to stop (POSIX only)
+    lock: threading.RLock = dataclasses.field(default_factory=threading.RLock) # Serializes tool calls; they all drive the same pdb process
+
+
+session = PdbSession()
+
+READ_CHUNK_SIZE = 65536       # Bytes requested per os.read() on pdb's stdout
+PDB_PROMPT = b"(Pdb) "        # Printed by pdb (without newline) when it awaits input
+# A run of prompts at the start of a line (queued commands make pdb print them back to back);
+# '(Pdb) ' anywhere else is program output and left alone
+PROMPT_RE = re.compile(rb"(?:^|(?<=\n))(?:\(Pdb\) )+")
+# Commands (including long-form aliases) after which the current location is shown
+NAV_COMMANDS = frozenset({'n', 'next', 's', 'step', 'c', 'cont', 'continue', 'r', 'return', 'unt', 'until'})
+# Files or directories that mark a project root
+ROOT_INDICATORS = frozenset({"pyproject.toml", ".git", "setup.py", "requirements.txt", "Pipfile", "poetry.lock"})
+# Commands that may run the program for a while before pdb prompts again
+LONG_COMMANDS = frozenset({'c', 'cont', 'continue', 'r', 'run', 'until', 'unt'})
+GRACEFUL_EXIT_TIMEOUT = 1.0   # Seconds end_debug waits after SIGINT and 'q' before terminating pdb
+# 'version = 3.11.7' (venv) or 'version_info = 3.12.1' (uv, virtualenv) in pyvenv.cfg
+PYVENV_VERSION_RE = re.compile(r"^version(?:_info)?\s*=\s*(\d+)\.(\d+)", re.MULTILINE)
+STARTUP_ERROR_RE = re.compile(r"Error:|Exception:") # Startup output that explains a missing prompt
+# pdb's replies to 'b' and 'cl', one alternative per idiom, read by parse_breakpoint_reply in a single pass
+BREAKPOINT_REPLY_RE = re.compile(r"Breakpoint (?P<set>\d+) at [^\n]*:(?P<line>\d+)\b"
+                                 r"|Deleted breakpoint (?P<deleted>\d+)"
+                                 r"|(?P<missing>No breakpoint)"
+                                 r"|(?P<failed>Error|(?i:multiple files))")
+# Joins examine_variable's fields; repr() escapes control characters, so it cannot occur inside one
+EXAMINE_SEPARATOR = "\x1e"
+TRAILING_SPACE_RE = re.compile(rb"[ \t\r]+$", re.MULTILINE) # Trimmed from each output line, as rstrip() would
+# Where pdb stopped: '> file(line)function()' followed by '-> source line'
+CURRENT_LINE_RE = re.compile(r"^> .+?\((\d+)\).*\n-> .*$", re.MULTILINE)
 
 # --- Helper Functions ---
 
 # Removed complex wrapper approach - using proper pytest debugging flags instead
 
-def read_pdb_output(process, output_queue):
-    """Read output from the pdb process and put it in the queue."""
+def read_chunks(fd, stop_fd=None):
+    """Yield blocks read from fd until EOF, or until stop_fd becomes readable.
+
+    Without stop_fd (Windows, where select() only handles sockets) this is a plain
+    blocking read loop.
+    """
+    if stop_fd is None:
+        while chunk := os.read(fd, READ_CHUNK_SIZE):
+            yield chunk
+        return
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+        selector.register(stop_fd, selectors.EVENT_READ)
+        while True:
+            ready = {key.fd for key, _ in selector.select()}
+            if fd not in ready:
+                return # Asked to stop, and nothing left to read
+            try:
+                chunk = os.read(fd, READ_CHUNK_SIZE)
+            except BlockingIOError:
+                continue # Spurious readiness; wait for the next event
+            if not chunk:
+                return
+            yield chunk
+
+
+def read_pdb_output(process, output_blocks, prompt_ready, output_eof, stop_fd=None):
+    """Read output from the pdb process, append it to output_blocks and signal prompt_ready.
+
+    output_eof is set when the stream ends so waiting consumers can stop early.
+    The reader also stops once stop_fd is readable, even if a surviving child
+    process keeps the pipe open.
+    """
     try:
-        # Use iter() with readline to avoid blocking readline() indefinitely
-        # if the process exits unexpectedly or stdout closes.
-        for line_bytes in iter(process.stdout.readline, b''):
-            output_queue.put(line_bytes.decode('utf-8', errors='replace').rstrip())
-    except ValueError:
-        # Handle ValueError if stdout is closed prematurely (e.g., process killed)
-        print("PDB output reader: ValueError (stdout likely closed).", file=sys.stderr)
+        # Read whole blocks from the raw fd and split lines ourselves; readline()
+        # on the pipe degenerates into many tiny reads for chatty pdb output.
+        fd = process.stdout.fileno()
+        buf = bytearray() # Incomplete trailing line carried over to the next block
+        for chunk in read_chunks(fd, stop_fd):
+            buf += chunk
+            # The prompt is written without a trailing newline, and with queued
+            # commands the next response follows it directly. A line therefore ends
+            # at a newline or right after a prompt, so each prompt is handed over
+            # as soon as it shows up. buf always starts at the start of a line.
+            prompts_end = 0
+            for match in PROMPT_RE.finditer(buf):
+                prompts_end = match.end()
+            end = max(buf.rfind(b"\n") + 1, prompts_end)
+            if not end:
+                continue
+            # Complete lines are queued as one raw block, each prompt on a line of its own;
+            # get_pdb_output decodes in one go
+            block = bytes(buf[:end])
+            if prompts_end:
+                block = PROMPT_RE.sub(lambda m: m.group().replace(PDB_PROMPT, PDB_PROMPT + b"\n"), block)
+            output_blocks.append(block)
+            del buf[:end]
+            # Consumers only return on a prompt, so only a block holding one wakes them
+            if prompts_end:
+                prompt_ready.set()
+        if buf:
+            output_blocks.append(bytes(buf) + b"\n") # Picked up through the EOF wake-up below
+    except (ValueError, OSError):
+        # Handle ValueError/OSError if stdout is closed prematurely (e.g., process killed)
+        logger.warning("PDB output reader: stdout closed unexpectedly.")
     except Exception as e:
-        print(f"PDB output reader: Unexpected error: {e}", file=sys.stderr)
+        logger.error("PDB output reader: Unexpected error: %s", e)
         # Optionally log traceback here if needed
     finally:
         # Ensure stdout is closed if loop finishes normally or breaks
@@ -50,63 +161,91 @@ def read_pdb_output(process, output_queue):
              try:
                  process.stdout.close()
              except Exception as e:
-                 print(f"PDB output reader: Error closing stdout: {e}", file=sys.stderr)
-        print("PDB output reader thread finished.", file=sys.stderr)
+                 logger.error("PDB output reader: Error closing stdout: %s", e)
+        if stop_fd is not None:
+            os.close(stop_fd)
+        output_eof.set()
+        prompt_ready.set() # Wake any consumer so it notices the end of the stream
+        logger.debug("PDB output reader thread finished.")
+
 
+def decode_output(output):
+    """Decode raw pdb output as one string, trimming trailing whitespace from every line."""
+    return TRAILING_SPACE_RE.sub(b"", output).decode('utf-8', errors='replace').removesuffix('\n')
 
-def get_pdb_output(timeout=0.5):
-    """Get accumulated output from the pdb process queue."""
-    output = []
-    start_time = time.monotonic()
+
+def get_pdb_output(timeout=0.5, prompts=1):
+    """Get accumulated output from the pdb process, up to the given number of prompts."""
+    output = bytearray()
+    output_blocks, prompt_ready = session.output_blocks, session.prompt_ready
+    deadline = time.monotonic() + timeout
     while True:
-        try:
-            # Calculate remaining time
-            remaining_time = timeout - (time.monotonic() - start_time)
-            if remaining_time <= 0:
-                break
-            line = pdb_output_queue.get(timeout=remaining_time)
-            output.append(line)
-            # Heuristic: If we see the pdb prompt, we likely have the main response
-            # Be careful as some commands might produce output containing (Pdb)
-            # Let's rely more on the timeout for now, but keep this in mind.
-            if line.strip().endswith('(Pdb)'):
-                break
-        except queue.Empty:
-            break # Timeout reached
-    return '\n'.join(output)
+        while output_blocks:
+            block = output_blocks.popleft()
+            # The reader put each prompt on a line of its own, so every match is one prompt
+            for match in PROMPT_RE.finditer(block):
+                prompts -= 1
+                if not prompts:
+                    # The response ends after the last prompt we wait for (and the newline the
+                    # reader put behind it); anything later stays queued for the next read
+                    end = match.end() + 1
+                    output += block[:end]
+                    if end < len(block):
+                        output_blocks.appendleft(block[end:])
+                    return decode_output(output)
+            output += block
+        remaining_time = deadline - time.monotonic()
+        if remaining_time <= 0:
+            break
+        # Clear before re-checking so a prompt queued in between is not missed
+        prompt_ready.clear()
+        if output_blocks:
+            continue
+        if session.output_eof.is_set():
+            break # Reader hit EOF; no more output will arrive
+        # On timeout, loop once more to collect prompt-less output before the deadline check
+        prompt_ready.wait(remaining_time)
+    return decode_output(output)
+
+
+def write_to_pdb(text):
+    """Write text to pdb's stdin with os.write, retrying until a partial write completes."""
+    data = memoryview(text.encode('utf-8'))
+    while data:
+        data = data[os.write(session.stdin_fd, data):]
 
 
 def send_to_pdb(command, timeout_multiplier=1.0):
     """Send a command to the pdb process and get its response.
 
+    Several newline-separated commands are written in one go; the combined
+    output is returned once pdb has prompted after each of them.
+
     Args:
-        command: The PDB command to send
+        command: The PDB command(s) to send
         timeout_multiplier: Multiplier to adjust timeout for complex commands
     """
-    global pdb_process, pdb_running
 
-    if pdb_process and pdb_process.poll() is None:
-        # Clear queue before sending command to get only relevant output
-        while not pdb_output_queue.empty():
-            try: pdb_output_queue.get_nowait()
-            except queue.Empty: break
+    if session.process and session.process.poll() is None:
+        # Discard stale output before sending command to get only relevant output
+        session.output_blocks.clear()
+        session.prompt_ready.clear()
 
         try:
             # Determine appropriate timeout based on command type
             base_timeout = 1.5
-            if command.strip().lower() in ('c', 'continue', 'r', 'run', 'until', 'unt'):
+            if command.split('\n', 1)[0].strip().lower() in LONG_COMMANDS:
                 timeout = base_timeout * 3 * timeout_multiplier
             else:
                 timeout = base_timeout * timeout_multiplier
 
-            pdb_process.stdin.write((command + '\n').encode('utf-8'))
-            pdb_process.stdin.flush()
+            write_to_pdb(command + '\n')
             # Wait a bit for command processing. Adjust if needed.
-            output = get_pdb_output(timeout=timeout) # Adjusted timeout for commands
+            output = get_pdb_output(timeout=timeout, prompts=command.count('\n') + 1) # Adjusted timeout for commands
 
             # Check if process ended right after the command
-            if pdb_process.poll() is not None:
-                 pdb_running = False
+            if session.process.poll() is not None:
+                 session.running = False
                  # Try to get any final output
                  final_output = get_pdb_output(timeout=0.1)
                  return f"Command output:\n{output}\n{final_output}\n\n*** The debugging session has ended. ***"
@@ -114,50 +253,164 @@ def send_to_pdb(command, timeout_multiplier=1.0):
             return output
 
         except (OSError, BrokenPipeError) as e:
-             print(f"Error writing to PDB stdin: {e}", file=sys.stderr)
-             pdb_running = False
+             logger.error("Error writing to PDB stdin: %s", e)
+             session.running = False
              # Try to get final output
              final_output = get_pdb_output(timeout=0.1)
-             if pdb_process:
-                 pdb_process.terminate() # Ensure process is stopped
-                 pdb_process.wait(timeout=0.5)
+             if session.process:
+                 terminate_process(session.process, timeout=0.5) # Ensure process is stopped
              return f"Error communicating with PDB: {e}\nFinal Output:\n{final_output}\n\n*** The debugging session has likely ended. ***"
         except Exception as e:
-            print(f"Unexpected error in send_to_pdb: {e}", file=sys.stderr)
-            pdb_running = False
+            logger.error("Unexpected error in send_to_pdb: %s", e)
+            session.running = False
             return f"Unexpected error sending command: {e}"
 
-    elif pdb_running:
+    elif session.running:
         # Process exists but poll() is not None, means it terminated
-        pdb_running = False
+        session.running = False
         final_output = get_pdb_output(timeout=0.1)
         return f"No active pdb process (it terminated).\nFinal Output:\n{final_output}"
     else:
         return "No active pdb process."
 
 
+@functools.lru_cache(maxsize=256)
+def normalize_path(path):
+    """Return the canonical absolute path (symlinks resolved) used as a breakpoint key."""
+    return os.path.realpath(path)
+
+
+def wait_for_exit(process, timeout):
+    """Wait up to timeout seconds for process to exit; return True if it has.
+
+    On Linux a pidfd becomes readable as soon as the child exits, so this wakes
+    immediately rather than on Popen.wait()'s polling interval.
+    """
+    if process.poll() is not None:
+        return True
+    try:
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError): # Not Linux 5.3+
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return False
+        return True
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(pidfd, selectors.EVENT_READ)
+            selector.select(timeout)
+    finally:
+        os.close(pidfd)
+    return process.poll() is not None
+
+
+def terminate_process(process, timeout=1.0):
+    """Terminate process, escalating to kill() if it has not exited within timeout seconds.
+
+    Every wait is bounded, so a child that ignores SIGTERM cannot stall the caller.
+    """
+    if process.poll() is not None:
+        return
+    process.terminate() # Send SIGTERM
+    if wait_for_exit(process, timeout):
+        logger.debug("PDB process terminated.")
+    else:
+        logger.warning("Terminate timed out. Killing process.")
+        process.kill() # Send SIGKILL
+        process.wait(timeout=timeout)
+        logger.debug("PDB process killed.")
+
+
+def stop_output_reader():
+    """Tell the current reader thread to stop by closing the write end of its stop pipe."""
+    if session.reader_stop_fd is not None:
+        try:
+            os.close(session.reader_stop_fd)
+        except OSError:
+            pass
+        session.reader_stop_fd = None
+
+
 def find_project_root(start_path):
-    """Find the project root containing pyproject.toml, .git or other indicators, searching upwards."""
-    current_dir = os.path.abspath(start_path)
-    # Common project root indicators
-    root_indicators = ["pyproject.toml", ".git", "setup.py", "requirements.txt", "Pipfile", "poetry.lock"]
+    """Find the project root containing pyproject.toml, .git or other indicators, searching upwards.
+
+    Results are cached per start_path, so repeated sessions in the same directory skip the
+    directory listings. The mtimes of the directories searched are part of the key, so an
+    indicator added or removed anywhere along the way is picked up.
+    """
+    start_path = os.path.abspath(start_path)
+    dir_mtimes = []
+    current_dir = start_path
+    while current_dir and current_dir != os.path.dirname(current_dir):
+        dir_mtimes.append(dir_mtime(current_dir)) # One stat per level
+        current_dir = os.path.dirname(current_dir)
+    return _find_project_root(start_path, tuple(dir_mtimes))
+
+
+@functools.lru_cache(maxsize=128)
+def _find_project_root(start_path, dir_mtimes):
+    current_dir = start_path
 
     # Guard against infinite loop if start_path is already root
     while current_dir and current_dir != os.path.dirname(current_dir):
-        for indicator in root_indicators:
-            if os.path.exists(os.path.join(current_dir, indicator)):
-                print(f"Found project root indicator '{indicator}' at: {current_dir}")
-                return current_dir
+        # One directory listing per level instead of a stat per indicator
+        try:
+            with os.scandir(current_dir) as entries:
+                found = ROOT_INDICATORS.intersection(entry.name for entry in entries)
+        except OSError:
+            found = None
+        if found:
+            logger.debug("Found project root indicator(s) %s at: %s", sorted(found), current_dir)
+            return current_dir
         current_dir = os.path.dirname(current_dir)
 
     # Fallback to the starting path's directory if no indicator found
-    fallback_dir = os.path.abspath(start_path)
-    print(f"No common project root indicators found upwards. Falling back to: {fallback_dir}")
+    fallback_dir = start_path
+    logger.debug("No common project root indicators found upwards. Falling back to: %s", fallback_dir)
     return fallback_dir
 
 
+def dir_mtime(path):
+    """Return the directory's mtime in ns (None if it cannot be read), for use in cache keys."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def file_signature(path):
+    """Return the file's (mtime in ns, size), or None if it cannot be read, for use in cache keys."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+@functools.lru_cache(maxsize=32)
+def _which(name, path):
+    return shutil.which(name, path=path)
+
+
+def which(name):
+    """shutil.which, cached per PATH value so repeated starts don't rescan PATH."""
+    return _which(name, os.environ.get('PATH'))
+
+
 def find_venv_details(project_root):
-    """Check for virtual environment directories and return python path and bin dir."""
+    """Check for virtual environment directories and return python path and bin dir.
+
+    Cached per project; the key covers the environment variables consulted and
+    the mtimes of the directories searched, so a newly created venv is found.
+    """
+    parent_dir = os.path.dirname(project_root)
+    return _find_venv_details(project_root, os.environ.get('VIRTUAL_ENV'), os.environ.get('CONDA_PREFIX'),
+                              os.environ.get('PATH', ''), dir_mtime(project_root), dir_mtime(parent_dir))
+
+
+@functools.lru_cache(maxsize=32)
+def _find_venv_details(project_root, virtual_env, conda_prefix, path, root_mtime, parent_mtime):
     common_venv_names = ['.venv', 'venv', 'env', '.env', 'virtualenv', '.virtualenv']
     common_venv_locations = [project_root]
 
@@ -166,24 +419,23 @@ def find_venv_details(project_root):
     if parent_dir != project_root:  # Avoid infinite loop at filesystem root
         common_venv_locations.append(parent_dir)
 
-    # First check for environment variables pointing to active virtual env
-    if 'VIRTUAL_ENV' in os.environ:
-        venv_path = os.environ['VIRTUAL_ENV']
-        if os.path.isdir(venv_path):
-            if sys.platform == "win32":
-                python_exe = os.path.join(venv_path, 'Scripts', 'python.exe')
-                bin_dir = os.path.join(venv_path, 'Scripts')
-            else:
-                python_exe = os.path.join(venv_path, 'bin', 'python')
-                bin_dir = os.path.join(venv_path, 'bin')
+    # Each candidate costs a single stat of its interpreter: a missing venv
+    # directory simply makes that stat fail, so it is not checked separately
+    venv_bin = 'Scripts' if sys.platform == "win32" else 'bin'
+    venv_python = 'python.exe' if sys.platform == "win32" else 'python'
 
-            if os.path.exists(python_exe):
-                print(f"Found active virtual environment: {venv_path}")
-                return python_exe, bin_dir
+    # First check for environment variables pointing to active virtual env
+    if virtual_env:
+        venv_path = virtual_env
+        bin_dir = os.path.join(venv_path, venv_bin)
+        python_exe = os.path.join(bin_dir, venv_python)
+        if os.path.isfile(python_exe):
+            logger.debug("Found active virtual environment: %s", venv_path)
+            return python_exe, bin_dir
 
     # Check for conda environment
-    if 'CONDA_PREFIX' in os.environ:
-        conda_path = os.environ['CONDA_PREFIX']
+    if conda_prefix:
+        conda_path = conda_prefix
         if sys.platform == "win32":
             python_exe = os.path.join(conda_path, 'python.exe')
             bin_dir = conda_path
@@ -191,75 +443,218 @@ def find_venv_details(project_root):
             python_exe = os.path.join(conda_path, 'bin', 'python')
             bin_dir = os.path.join(conda_path, 'bin')
 
-        if os.path.exists(python_exe):
-            print(f"Found conda environment: {conda_path}")
+        if os.path.isfile(python_exe):
+            logger.debug("Found conda environment: %s", conda_path)
             return python_exe, bin_dir
 
     for location in common_venv_locations:
         for name in common_venv_names:
             venv_path = os.path.join(location, name)
-            if os.path.isdir(venv_path):
-                if sys.platform == "win32":
-                    python_exe = os.path.join(venv_path, 'Scripts', 'python.exe')
-                    bin_dir = os.path.join(venv_path, 'Scripts')
-                else:
-                    python_exe = os.path.join(venv_path, 'bin', 'python')
-                    bin_dir = os.path.join(venv_path, 'bin')
-
-                if os.path.exists(python_exe):
-                    print(f"Found virtual environment: {venv_path}")
-                    return python_exe, bin_dir
+            bin_dir = os.path.join(venv_path, venv_bin)
+            python_exe = os.path.join(bin_dir, venv_python)
+            if os.path.isfile(python_exe):
+                logger.debug("Found virtual environment: %s", venv_path)
+                return python_exe, bin_dir
 
     # Look for other common Python installations
     if sys.platform == "win32":
-        for path in os.environ["PATH"].split(os.pathsep):
-            py_exe = os.path.join(path, "python.exe")
-            if os.path.exists(py_exe):
-                return py_exe, path
+        for path_dir in path.split(os.pathsep):
+            py_exe = os.path.join(path_dir, "python.exe")
+            if os.path.isfile(py_exe):
+                return py_exe, path_dir
     else:
         # On Unix, check if we have a user-installed Python in .local/bin
+        # Try the usual interpreter names directly rather than listing the directory
         local_bin = os.path.expanduser("~/.local/bin")
-        if os.path.exists(local_bin):
-            for f in os.listdir(local_bin):
-                if f.startswith("python") and os.path.isfile(os.path.join(local_bin, f)):
-                    py_exe = os.path.join(local_bin, f)
-                    return py_exe, local_bin
+        for name in ("python", "python3", f"python3.{sys.version_info.minor}"):
+            py_exe = os.path.join(local_bin, name)
+            if os.path.isfile(py_exe):
+                return py_exe, local_bin
 
-    print(f"No virtual environment found in: {project_root}")
+    logger.debug("No virtual environment found in: %s", project_root)
     return None, None
 
 
-def has_poetry_config(project_root):
-    """Check if project has Poetry configuration in pyproject.toml"""
-    pyproject_path = os.path.join(project_root, "pyproject.toml")
-    if not os.path.exists(pyproject_path):
+def venv_has_pytest(venv_python_path, venv_bin_dir, project_root, env):
+    """Return True if the venv's python can run 'python -m pytest'.
+
+    Checks site-packages first and only falls back to launching the interpreter
+    when the package isn't there (e.g. it comes from system site-packages).
+    Cached per venv; the bin dir's mtime is part of the key, so installing pytest
+    (which adds its script there) is picked up. The probe runs with env, the
+    environment prepared for the venv, which is keyed as a sorted item tuple.
+    """
+    return _venv_has_pytest(venv_python_path, venv_bin_dir, project_root, tuple(sorted(env.items())),
+                            dir_mtime(venv_bin_dir))
+
+
+@functools.lru_cache(maxsize=32)
+def _venv_has_pytest(venv_python_path, venv_bin_dir, project_root, env_items, bin_mtime):
+    venv_dir = os.path.dirname(venv_bin_dir)
+    # Only the interpreter's own site-packages counts. Without a pyvenv.cfg version (e.g. the
+    # ~/.local fallback, which may hold packages for other Pythons) the probe below decides.
+    python_version = venv_python_version(venv_dir)
+    if python_version:
+        site_packages_paths = (
+            os.path.join(venv_dir, 'lib', f'python{python_version}', 'site-packages', 'pytest'),
+            os.path.join(venv_dir, 'Lib', 'site-packages', 'pytest'), # Windows layout
+        )
+        if any(os.path.isdir(path) for path in site_packages_paths):
+            return True
+    try:
+        # cwd is on sys.path for 'python -m', so a pytest vendored in the project counts too
+        subprocess.run([venv_python_path, "-m", "pytest", "--version"], capture_output=True, check=True,
+                       cwd=project_root, env=dict(env_items))
+        return True
+    except (subprocess.CalledProcessError, FileNotFoundError):
         return False
-    
+
+
+def venv_python_version(venv_dir):
+    """Return the venv's Python version as 'X.Y' from its pyvenv.cfg, or None if it cannot be read."""
+    try:
+        with open(os.path.join(venv_dir, 'pyvenv.cfg'), encoding='utf-8') as f:
+            match = PYVENV_VERSION_RE.search(f.read())
+    except (OSError, UnicodeDecodeError):
+        return None
+    return f"{match[1]}.{match[2]}" if match else None
+
+
+def read_pyproject_tools(project_root):
+    """Return the names of the [tool.*] tables declared in the project's pyproject.toml."""
+    pyproject_path = os.path.join(project_root, "pyproject.toml")
     try:
-        with open(pyproject_path, 'r') as f:
+        with open(pyproject_path, 'rb') as f:
             content = f.read()
-            return '[tool.poetry]' in content
     except (IOError, OSError):
-        return False
+        return set()
+
+    if tomllib is not None:
+        try:
+            return set(tomllib.loads(content.decode('utf-8')).get('tool', {}))
+        except (tomllib.TOMLDecodeError, UnicodeDecodeError):
+            pass
+    # No tomllib (Python 3.10) or unparsable file: fall back to scanning table headers
+    return set(re.findall(r"^\[+tool\.([A-Za-z0-9_-]+)", content.decode('utf-8', errors='replace'), re.MULTILINE))
+
+
+def detect_project_tooling(project_root):
+    """Return (is_uv_project, is_poetry_project) based on the files in project_root.
+
+    Cached per directory. The directory's mtime and pyproject.toml's mtime and size
+    are part of the key, so adding or removing a lock file and editing pyproject.toml
+    in place are both picked up without re-probing unchanged projects.
+    """
+    pyproject_sig = file_signature(os.path.join(project_root, "pyproject.toml"))
+    return _detect_project_tooling(project_root, dir_mtime(project_root), pyproject_sig)
+
+
+@functools.lru_cache(maxsize=128)
+def _detect_project_tooling(project_root, root_mtime, pyproject_sig):
+    pyproject_path = os.path.join(project_root, "pyproject.toml")
+    if not os.path.exists(pyproject_path):
+        return False, False
+
+    # pyproject.toml is parsed once and shared by both checks
+    tools = read_pyproject_tools(project_root)
+    # uv.lock is the primary indicator, then any [tool.uv] configuration
+    is_uv_project = os.path.exists(os.path.join(project_root, "uv.lock")) or 'uv' in tools
+    # Check for Poetry-specific indicators
+    is_poetry_project = os.path.exists(os.path.join(project_root, "poetry.lock")) or 'poetry' in tools
+    return is_uv_project, is_poetry_project
 
 
 def sanitize_arguments(args_str):
-    """Validate and sanitize command line arguments to prevent injection."""
-    dangerous_patterns = [';', '&&', '||', '`', '$(', '|', '>', '<']
-    for pattern in dangerous_patterns:
-        if pattern in args_str:
-            raise ValueError(f"Invalid character in arguments: {pattern}")
+    """Split command line arguments shell-style, for passing to the debuggee as a list.
+
+    Safety comes from launching without a shell (Popen with an argument list), so
+    characters such as '>' or '|' are passed through literally. On Windows, batch
+    shims (e.g. poetry.cmd) hand the command line to cmd.exe, so the original
+    blocklist of shell metacharacters is still enforced there.
+    """
+    if sys.platform == "win32":
+        dangerous_patterns = [';', '&&', '||', '`', '$(', '|', '>', '<']
+        for pattern in dangerous_patterns:
+            if pattern in args_str:
+                raise ValueError(f"Invalid character in arguments: {pattern}")
 
     try:
-        parsed_args = shlex.split(args_str)
-        return parsed_args
+        return shlex.split(args_str)
     except ValueError as e:
-        raise ValueError(f"Error parsing arguments: {e}")
+        raise ValueError(f"Error parsing arguments: {e}") from e
+
+
+@functools.lru_cache(maxsize=256)
+def project_relpath(abs_path, project_root):
+    """Return abs_path relative to project_root for pdb commands, or abs_path if it cannot be made relative."""
+    if abs_path.startswith(project_root + os.sep):
+        return abs_path[len(project_root) + 1:] # Common case: inside the root, a slice is all relpath would do
+    try:
+        rel_path = os.path.relpath(abs_path, project_root)
+    except ValueError:
+        return abs_path # Fallback if not relative (e.g., different drive on Windows)
+    # Handle edge case where the target is the project root itself
+    return os.path.basename(abs_path) if rel_path == '.' else rel_path
+
+
+def track_breakpoint(bp_key, bp_number):
+    """Record bp_number for bp_key, keeping session.breakpoints in key order so readers need not sort."""
+    breakpoints = session.breakpoints
+    out_of_order = bp_key not in breakpoints and breakpoints and bp_key < next(reversed(breakpoints))
+    breakpoints[bp_key] = bp_number
+    if out_of_order:
+        session.breakpoints = dict(sorted(breakpoints.items())) # Only when a key lands mid-table
+
+
+def parse_breakpoint_reply(response):
+    """Scan pdb's reply to 'b' or 'cl' once.
+
+    Returns ({line: bp_number} for each breakpoint pdb confirmed setting, and the idioms
+    found in order of appearance: 'set', 'deleted', 'missing' or 'failed').
+    """
+    set_numbers, outcomes = {}, []
+    for match in BREAKPOINT_REPLY_RE.finditer(response):
+        if match['set']:
+            set_numbers.setdefault(int(match['line']), match['set'])
+            outcomes.append('set')
+        else:
+            outcomes.append(match.lastgroup)
+    return set_numbers, outcomes
+
+
+def format_tracked_breakpoints(base_dir):
+    """Format tracked breakpoints as 'path:line (BP #n)', with paths relative to base_dir where possible."""
+    if not session.breakpoints:
+        return [] # The usual case until the first set_breakpoint
+    # Each file is resolved once per call, and once per base_dir across calls
+    disp_paths = {abs_path: project_relpath(abs_path, base_dir) for abs_path, _ in session.breakpoints}
+    return [f"{disp_paths[abs_path]}:{line_num} (BP #{bp_number})" if bp_number else f"{disp_paths[abs_path]}:{line_num}"
+            for (abs_path, line_num), bp_number in session.breakpoints.items()]
 
 
 # --- MCP Tools ---
 
-@mcp.tool()
+def pdb_tool(fn):
+    """Register fn as an MCP tool that runs in a worker thread instead of the event loop.
+
+    FastMCP calls sync tools directly on its event loop, so a tool waiting on pdb
+    would stall the whole server. The lock is taken inside the worker thread, which
+    keeps calls serialized even if an awaiting request is cancelled. fn itself is
+    returned unchanged so tools can keep calling each other synchronously.
+    """
+    def locked_call(*args, **kwargs):
+        with session.lock:
+            return fn(*args, **kwargs)
+
+    @functools.wraps(fn)
+    async def run_tool(*args, **kwargs):
+        return await asyncio.to_thread(locked_call, *args, **kwargs)
+
+    mcp.tool()(run_tool)
+    return fn
+
+
+@pdb_tool
 def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest_debug_mode: str = "pdb") -> str:
     """Start a debugging session on a Python file within its project context.
 
@@ -272,91 +667,81 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
             - "trace": Run pytest --trace (debug at start of each test)
             - "manual": Run python -m pdb -m pytest (full debugger control)
     """
-    global pdb_process, pdb_running, current_file, current_project_root, output_thread
-    global pdb_output_queue, breakpoints, current_args, current_use_pytest
 
-    if pdb_running:
+    if session.running:
         # Check if the process is *really* still running
-        if pdb_process and pdb_process.poll() is None:
-            return f"Debugging session already running for {current_file}. Use restart_debug or end_debug first."
+        if session.process and session.process.poll() is None:
+            return f"Debugging session already running for {session.file}. Use restart_debug or end_debug first."
         else:
-            print("Detected stale 'pdb_running' state. Resetting.")
-            pdb_running = False # Reset state if process died
+            logger.warning("Detected stale 'session.running' state. Resetting.")
+            session.running = False # Reset state if process died
 
     # --- Validate Input and Find Project ---
-    # Try multiple potential locations for the file
-    paths_to_check = [
-        file_path,                              # As provided
-        os.path.abspath(file_path),             # Absolute path
-        os.path.join(os.getcwd(), file_path),   # Relative to CWD
-    ]
-
-    # Add common directories to search in
-    for common_dir in ["src", "tests", "lib"]:
-        paths_to_check.append(os.path.join(os.getcwd(), common_dir, file_path))
-
-    # Check all possible paths
+    # Safely parse arguments (shlex, so quoted values survive) before any project
+    # discovery or state changes: a typo fails fast and restart_debug won't reuse it
+    try:
+        parsed_args = sanitize_arguments(args)
+    except ValueError as e:
+        return f"Error in arguments: {e}"
+
+    cwd = os.getcwd()
+    # pytest can also be pointed at a test directory; a script has to be a file
+    is_target = os.path.exists if use_pytest else os.path.isfile
     abs_file_path = None
-    for path in paths_to_check:
-        if os.path.exists(path):
-            abs_file_path = path
-            break
+    if os.path.isabs(file_path):
+        # Absolute paths (the usual case from MCP clients) need a single check
+        if is_target(file_path):
+            abs_file_path = file_path
+    else:
+        # Try multiple potential locations for the file. "As provided", its abspath and
+        # cwd-joined forms all name the same file, so a single cwd-joined candidate covers them
+        for path in (os.path.join(cwd, file_path),
+                     *(os.path.join(cwd, common_dir, file_path) for common_dir in ("src", "tests", "lib"))):
+            if is_target(path):
+                abs_file_path = path
+                break
 
     if not abs_file_path:
         return f"Error: File not found at '{file_path}' (checked multiple locations including CWD, src/, tests/, lib/)"
 
+    # Canonical path, so the project root and breakpoint keys derive from one spelling
+    abs_file_path = normalize_path(abs_file_path)
     file_dir = os.path.dirname(abs_file_path)
     project_root = find_project_root(file_dir)
 
     # --- Update Global State ---
-    current_project_root = project_root
-    current_file = abs_file_path
-    current_args = args
-    current_use_pytest = use_pytest
+    session.project_root = project_root
+    session.file = abs_file_path
+    session.args = args
+    session.use_pytest = use_pytest
 
     # Store original working directory before changing
-    original_working_dir = os.getcwd()
-    print(f"Original working directory: {original_working_dir}")
-
-    # Initialize breakpoints structure for this file if new
-    if current_file not in breakpoints:
-        breakpoints[current_file] = {}
+    original_working_dir = cwd
+    logger.debug("Original working directory: %s", original_working_dir)
 
-    # Clear the output queue rigorously
-    while not pdb_output_queue.empty():
-        try: pdb_output_queue.get_nowait()
-        except queue.Empty: break
+    # Give the new session fresh output buffers rather than clearing the old ones,
+    # so a previous reader thread that is still draining cannot leak stale lines in
+    session.output_blocks = collections.deque()
+    session.prompt_ready = threading.Event()
+    session.output_eof = threading.Event()
 
     try:
         # --- Determine Execution Environment ---
         use_uv = False
         use_poetry = False
-        uv_path = shutil.which("uv")
-        poetry_path = shutil.which("poetry")
+        uv_path = which("uv")
+        poetry_path = which("poetry")
         venv_python_path = None
         venv_bin_dir = None
 
-        if uv_path and os.path.exists(os.path.join(project_root, "pyproject.toml")):
-            # More reliably check for uv.lock as primary indicator
-            if os.path.exists(os.path.join(project_root, "uv.lock")):
-                 print("Found uv.lock, assuming uv project.")
-                 use_uv = True
-            else:
-                 # Check pyproject.toml for [tool.uv] configuration
-                 try:
-                     with open(os.path.join(project_root, "pyproject.toml"), 'r') as f:
-                         content = f.read()
-                         if '[tool.uv]' in content:
-                             print("Found [tool.uv] in pyproject.toml, assuming uv project.")
-                             use_uv = True
-                 except (IOError, OSError):
-                     pass
-
-        if not use_uv and poetry_path and os.path.exists(os.path.join(project_root, "pyproject.toml")):
-            # Check for Poetry-specific indicators
-            if os.path.exists(os.path.join(project_root, "poetry.lock")) or has_poetry_config(project_root):
-                print("Found Poetry project")
-                use_poetry = True
+        is_uv_project, is_poetry_project = detect_project_tooling(project_root)
+
+        if uv_path and is_uv_project:
+            logger.debug("Found uv project (uv.lock or [tool.uv] in pyproject.toml).")
+            use_uv = True
+        elif poetry_path and is_poetry_project:
+            logger.debug("Found Poetry project")
+            use_poetry = True
 
         if not use_uv and not use_poetry:
             # Look for a standard venv if uv or poetry isn't detected/used
@@ -364,32 +749,20 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
 
         # --- Prepare Command and Subprocess Environment ---
         cmd = []
-        # Start with a clean environment copy, modify selectively
-        env = os.environ.copy()
+        # Inherit os.environ as-is (env=None) unless a branch below needs to modify it
+        env = None
 
         # Calculate relative path from project root (preferred for tools)
-        try:
-            rel_file_path = os.path.relpath(abs_file_path, project_root)
-            # Handle edge case where file is the project root itself (e.g., debugging a script there)
-            if rel_file_path == '.':
-                rel_file_path = os.path.basename(abs_file_path)
-
-        except ValueError:
-             # Handle cases where file is on a different drive (Windows)
-             print(f"Warning: File '{abs_file_path}' not relative to project root '{project_root}'. Using absolute path.")
-             rel_file_path = abs_file_path # Use absolute path if relative fails
-
-
-        # Safely parse arguments using sanitize_arguments
-        try:
-            parsed_args = sanitize_arguments(args)
-        except ValueError as e:
-            return f"Error in arguments: {e}"
+        rel_file_path = project_relpath(abs_file_path, project_root)
+        if rel_file_path == abs_file_path:
+             # Happens when the file is on a different drive (Windows)
+             logger.warning("File '%s' not relative to project root '%s'. Using absolute path.", abs_file_path, project_root)
 
         # Determine command based on environment
         if use_uv:
-            print(f"Using uv run in: {project_root}")
+            logger.debug("Using uv run in: %s", project_root)
             # Clean potentially conflicting env vars for uv run
+            env = os.environ.copy()
             env.pop('VIRTUAL_ENV', None)
             env.pop('PYTHONHOME', None)
             base_cmd = ["uv", "run", "--"]
@@ -410,8 +783,9 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
                 base_cmd.extend(["python", "-m", "pdb"])
                 cmd = base_cmd + [rel_file_path] + parsed_args
         elif use_poetry:
-            print(f"Using poetry run in: {project_root}")
+            logger.debug("Using poetry run in: %s", project_root)
             # Clean potentially conflicting env vars for poetry run
+            env = os.environ.copy()
             env.pop('VIRTUAL_ENV', None)
             env.pop('PYTHONHOME', None)
             if use_pytest:
@@ -431,8 +805,9 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
                 base_cmd = ["poetry", "run", "python", "-m", "pdb"]
                 cmd = base_cmd + [rel_file_path] + parsed_args
         elif venv_python_path:
-            print(f"Using venv Python: {venv_python_path}")
+            logger.debug("Using venv Python: %s", venv_python_path)
             venv_dir = os.path.dirname(os.path.dirname(venv_bin_dir)) # Get actual venv root
+            env = os.environ.copy()
             env['VIRTUAL_ENV'] = venv_dir
             env['PATH'] = f"{venv_bin_dir}{os.pathsep}{env.get('PATH', '')}"
             env.pop('PYTHONHOME', None)
@@ -448,17 +823,15 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
                 pytest_exe = os.path.join(venv_bin_dir, 'pytest' + ('.exe' if sys.platform == 'win32' else ''))
                 if not os.path.exists(pytest_exe):
                     # Try finding via the venv python itself
-                    try:
-                        result = subprocess.run([venv_python_path, "-m", "pytest", "--version"], capture_output=True, text=True, check=True, cwd=project_root, env=env)
-                        print(f"Found pytest via '{venv_python_path} -m pytest'")
-                        if pytest_debug_mode == "manual":
-                            cmd = [venv_python_path, "-m", "pdb", "-m", "pytest", "-s", rel_file_path] + parsed_args
-                        elif pytest_debug_mode == "trace":
-                            cmd = [venv_python_path, "-m", "pytest", "--trace", "-s", rel_file_path] + parsed_args
-                        else:  # pytest_debug_mode == "pdb"
-                            cmd = [venv_python_path, "-m", "pytest", "--pdb", "-s", rel_file_path] + parsed_args
-                    except (subprocess.CalledProcessError, FileNotFoundError):
+                    if not venv_has_pytest(venv_python_path, venv_bin_dir, project_root, env):
                          return f"Error: pytest not found or executable in the virtual environment at {venv_bin_dir}. Cannot run with --pytest."
+                    logger.debug("Found pytest via '%s -m pytest'", venv_python_path)
+                    if pytest_debug_mode == "manual":
+                        cmd = [venv_python_path, "-m", "pdb", "-m", "pytest", "-s", rel_file_path] + parsed_args
+                    elif pytest_debug_mode == "trace":
+                        cmd = [venv_python_path, "-m", "pytest", "--trace", "-s", rel_file_path] + parsed_args
+                    else:  # pytest_debug_mode == "pdb"
+                        cmd = [venv_python_path, "-m", "pytest", "--pdb", "-s", rel_file_path] + parsed_args
                 else:
                     if pytest_debug_mode == "manual":
                         cmd = [venv_python_path, "-m", "pdb", "-m", "pytest", "-s", rel_file_path] + parsed_args
@@ -469,14 +842,14 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
             else:
                 cmd = [venv_python_path, "-m", "pdb", rel_file_path] + parsed_args
         else:
-            print("Warning: No uv, poetry, or standard venv detected in project root. Using system Python/pytest.")
+            logger.info("No uv, poetry, or standard venv detected in project root. Using system Python/pytest.")
             # Fallback to system python/pytest found in PATH
-            python_exe = shutil.which("python") or sys.executable # Find system python more reliably
+            python_exe = which("python") or sys.executable # Find system python more reliably
             if not python_exe:
                  return "Error: Could not find 'python' executable in system PATH."
 
             if use_pytest:
-                 pytest_exe = shutil.which("pytest")
+                 pytest_exe = which("pytest")
                  if not pytest_exe:
                      return "Error: pytest command not found in system PATH. Cannot run with --pytest."
                  if pytest_debug_mode == "manual":
@@ -489,47 +862,58 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
                  cmd = [python_exe, "-m", "pdb", rel_file_path] + parsed_args
 
         # --- Launch Subprocess ---
-        print(f"Executing command: {' '.join(map(shlex.quote, cmd))}")
-        print(f"Working directory: {project_root}")
-        print(f"Using VIRTUAL_ENV: {env.get('VIRTUAL_ENV', 'Not Set')}")
-        # print(f"Using PATH: {env.get('PATH', 'Not Set')}") # Can be very long
+        logger.debug("Executing command: %s", ' '.join(map(shlex.quote, cmd)))
+        logger.debug("Working directory: %s", project_root)
+        logger.debug("Using VIRTUAL_ENV: %s", (env or os.environ).get('VIRTUAL_ENV', 'Not Set'))
+        # logger.debug("Using PATH: %s", (env or os.environ).get('PATH', 'Not Set')) # Can be very long
 
         # Ensure previous thread is not running (important for restarts)
-        if output_thread and output_thread.is_alive():
-             print("Warning: Previous output thread was still alive.", file=sys.stderr)
+        if session.output_thread and session.output_thread.is_alive():
+             logger.warning("Previous output thread was still alive.")
              # Attempting to join might hang if readline blocks, so we just detach.
 
-        pdb_process = subprocess.Popen(
+        session.process = subprocess.Popen(
             cmd,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT, # Merge stderr to stdout for easier capture
-            text=False, # Read bytes for reliable readline behavior
+            text=False, # Bytes; stdout is read straight from its fd by the reader thread
             cwd=project_root, # <<< CRITICAL: Run from project root
-            env=env,          # Pass the prepared environment
-            bufsize=0         # Use system default buffering (often line-buffered)
+            env=env,          # Pass the prepared environment (None inherits ours)
         )
-
-        # Start the output reader thread anew
-        output_thread = threading.Thread(
+        # Commands bypass the buffered writer and go straight to the pipe
+        session.stdin_fd = session.process.stdin.fileno()
+
+        # Start the output reader thread anew, with a pipe end_debug can use to stop it
+        stop_output_reader()
+        stop_fd = None
+        if sys.platform != "win32":
+            stop_fd, session.reader_stop_fd = os.pipe()
+        session.output_thread = threading.Thread(
             target=read_pdb_output,
-            args=(pdb_process, pdb_output_queue),
+            args=(session.process, session.output_blocks, session.prompt_ready, session.output_eof, stop_fd),
             daemon=True # Allows main program to exit even if thread is running
         )
-        output_thread.start()
+        session.output_thread.start()
 
-        pdb_running = True # Set running state *before* waiting for output
+        session.running = True # Set running state *before* waiting for output
 
         # --- Wait for Initial Output & Verify Start ---
-        print("Waiting for PDB to start...")
+        logger.debug("Waiting for PDB to start...")
         initial_output = get_pdb_output(timeout=30.0) # Longer timeout for potentially slow starts/imports
 
-        # Check if process died immediately
-        if pdb_process.poll() is not None:
-             exit_code = pdb_process.poll()
-             pdb_running = False
+        # Check if process died immediately. Its stdout can close a moment before
+        # it is reaped, so give a process whose output already ended time to exit.
+        if session.output_eof.is_set():
+            try:
+                session.process.wait(timeout=1.0)
+            except subprocess.TimeoutExpired:
+                pass
+        if session.process.poll() is not None:
+             exit_code = session.process.poll()
+             session.running = False
              # Attempt to get any remaining output directly if thread missed it
-             final_out_bytes, _ = pdb_process.communicate()
+             final_out_bytes, _ = session.process.communicate()
              final_out_str = final_out_bytes.decode('utf-8', errors='replace')
              full_output = initial_output + "\n" + final_out_str.strip()
              return (f"Error: PDB process exited immediately (Code: {exit_code}). "
@@ -537,23 +921,23 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
                      f"Working Dir: {project_root}\n"
                      f"Output:\n---\n{full_output}\n---")
 
-        # Check for typical PDB prompt indicators
-        # Needs to be somewhat lenient as initial output varies (e.g., pytest header)
-        has_pdb_prompt = "-> " in initial_output or "(Pdb)" in initial_output
-        has_error = "Error:" in initial_output or "Exception:" in initial_output
+        # get_pdb_output stops right after the first prompt, so a started pdb leaves it
+        # as the last line. Only the prompt counts: stderr is merged into this stream,
+        # and tracebacks or annotations ('def f() -> None') contain '-> ' as well.
+        has_pdb_prompt = initial_output.endswith("(Pdb)")
 
         if not has_pdb_prompt:
              # If no prompt but also no obvious error and process is running,
              # it might be okay, just slower startup or waiting.
-             if pdb_process.poll() is None and not has_error:
-                  warning_msg = ("Warning: PDB started but initial prompt ('-> ' or '(Pdb)') "
+             if session.process.poll() is None and not STARTUP_ERROR_RE.search(initial_output):
+                  warning_msg = ("Warning: PDB started but initial prompt ('(Pdb)') "
                                  "not detected in first few seconds. It might be running.")
-                  print(warning_msg, file=sys.stderr)
+                  logger.warning("%s", warning_msg)
                   # Proceed but include the warning in the return message
                   initial_output = f"{warning_msg}\n\n{initial_output}"
              else:
                   # No prompt, process might have died silently or has error message
-                  pdb_running = False
+                  session.running = False
                   # Try to get more output
                   final_output = get_pdb_output(timeout=0.5)
                   full_output = initial_output + "\n" + final_output
@@ -563,49 +947,43 @@ def start_debug(file_path: str, use_pytest: bool = False, args: str = "", pytest
                            f"Output:\n---\n{full_output}\n---")
 
         # --- Restore Breakpoints ---
-        restored_bps_output = ""
-        if current_file in breakpoints and breakpoints[current_file]:
-            print(f"Restoring {len(breakpoints[current_file])} breakpoints for {rel_file_path}...")
-            # Use relative path for consistency in breakpoint commands
-            try:
-                bp_rel_path = os.path.relpath(current_file, project_root)
-                if bp_rel_path == '.': bp_rel_path = os.path.basename(current_file)
-            except ValueError:
-                bp_rel_path = current_file # Fallback
-
-            restored_bps_output += "\n--- Restoring Breakpoints ---\n"
-            # Sort by line number for clarity
-            for line_num in sorted(breakpoints[current_file].keys()):
-                bp_command_rel = f"b {bp_rel_path}:{line_num}"
-                print(f"Sending restore cmd: {bp_command_rel}")
-                restore_out = send_to_pdb(bp_command_rel)
-                restored_bps_output += f"Set {bp_rel_path}:{line_num}: {restore_out or '[No Response]'}\n"
-
-                # Extract and update BP number if available
-                match = re.search(r"Breakpoint (\d+) at", restore_out)
-                if match:
-                    bp_data = breakpoints[current_file][line_num]
-                    if isinstance(bp_data, dict):
-                        bp_data["bp_number"] = match.group(1)
-                    else:
-                        # Backward compatibility with older format
-                        breakpoints[current_file][line_num] = {
-                            "command": bp_data,
-                            "bp_number": match.group(1)
-                        }
-
-            restored_bps_output += "--- Breakpoint Restore Complete ---\n"
-
+        restored_bps = []
+        # Numbers from the old process are meaningless now, including for breakpoints that are
+        # not replayed; dict.fromkeys keeps the key order and leaves each number None
+        session.breakpoints = dict.fromkeys(session.breakpoints)
+        # Every tracked breakpoint in this project, already grouped by file and sorted by line
+        restore_keys = [bp_key for bp_key in session.breakpoints
+                        if bp_key[0] == abs_file_path or bp_key[0].startswith(project_root + os.sep)]
+        if restore_keys:
+            logger.debug("Restoring %s breakpoints...", len(restore_keys))
+            restored_bps.append("\n--- Restoring Breakpoints ---")
+            # Paths relative to the project root, as set_breakpoint sends them
+            restore_specs = [f"{project_relpath(path, project_root)}:{line_num}" for path, line_num in restore_keys]
+            # Send every 'b' command in one write
+            restore_out = send_to_pdb("\n".join(f"b {spec}" for spec in restore_specs))
+            # pdb answers the commands in order, each reply ending at its prompt
+            replies = [reply.strip() for reply in restore_out.split("(Pdb)")]
+            replies += [""] * len(restore_keys) # Pad in case the session ended part-way
+            for bp_key, spec, reply in zip(restore_keys, restore_specs, replies):
+                restored_bps.append(f"Set {spec}: {reply or '[No Response]'}")
+
+                # Record the new number, if pdb confirmed one
+                set_numbers, _ = parse_breakpoint_reply(reply)
+                session.breakpoints[bp_key] = set_numbers.get(bp_key[1])
+
+            restored_bps.append("--- Breakpoint Restore Complete ---\n")
+
+        restored_bps_output = "\n".join(restored_bps)
         return f"Debugging session started for {rel_file_path} (in {project_root})\n\n{initial_output}\n{restored_bps_output}"
 
     except FileNotFoundError as e:
-         pdb_running = False
+         session.running = False
          return f"Error starting debugging session: Command not found ({e.filename}). Is '{cmd[0]}' installed and in the correct PATH (system or venv)?\n{traceback.format_exc()}"
     except Exception as e:
-        pdb_running = False
+        session.running = False
         return f"Error starting debugging session: {str(e)}\n{traceback.format_exc()}"
 
-@mcp.tool()
+@pdb_tool
 def send_pdb_command(command: str) -> str:
     """Send a command to the running PDB instance.
 
@@ -621,60 +999,58 @@ def send_pdb_command(command: str) -> str:
     Args:
         command: The PDB command string.
     """
-    global pdb_running, pdb_process
 
-    if not pdb_running:
+    if not session.running:
         return "No active debugging session. Use start_debug first."
 
     # Double check process liveness
-    if pdb_process is None or pdb_process.poll() is not None:
-         pdb_running = False
+    if session.process is None or session.process.poll() is not None:
+         session.running = False
          final_output = get_pdb_output(timeout=0.1)
          return f"The debugging session appears to have ended.\nFinal Output:\n{final_output}"
 
     try:
+        # Classify on the first word so commands with arguments (e.g. 'until 42') count too
+        command_words = command.split(maxsplit=1)
+        cmd_key = command_words[0].lower() if command_words else ""
+
         # Determine appropriate timeout based on command complexity
         timeout_multiplier = 1.0
-        if command.strip().lower() in ('c', 'continue', 'r', 'run'):
+        if cmd_key in LONG_COMMANDS:
             # These commands might take longer to complete
             timeout_multiplier = 2.0
 
         response = send_to_pdb(command, timeout_multiplier)
 
         # Check if the session ended after this specific command (e.g., 'q' or fatal error)
-        if not pdb_running: # send_to_pdb might set this if process ended
+        if not session.running: # send_to_pdb might set this if process ended
              return f"Command output:\n{response}" # Response already includes end notice
 
-        # Provide extra context for common navigation commands
-        # Only do this if the session is still running
-        nav_commands = ['n', 's', 'c', 'r', 'unt', 'until', 'next', 'step', 'continue', 'return']
-        if command.strip().lower() in nav_commands and pdb_running and pdb_process.poll() is None:
-            # Give PDB a tiny bit more time after navigation before asking for location
-            # Check again if it's running before sending 'l .'
-            if pdb_running and pdb_process.poll() is None:
-                print("Fetching context after navigation...")
+        # Provide extra context for common navigation commands. pdb already reports
+        # where it stopped, so only ask for a listing when that report is missing.
+        if cmd_key in NAV_COMMANDS:
+            locations = list(CURRENT_LINE_RE.finditer(response))
+            if locations:
+                line_context = locations[-1].group(0)
+            else:
+                logger.debug("Fetching context after navigation...")
                 line_context = send_to_pdb("l .")
-                 # Check again after sending 'l .'
-                if pdb_running and pdb_process.poll() is None:
-                    response += f"\n\n-- Current location --\n{line_context}"
-                else:
-                    response += "\n\n-- Session ended after navigation --"
-                    pdb_running = False # Ensure state is correct
+            response += f"\n\n-- Current location --\n{line_context}"
 
         return f"Command output:\n{response}"
 
     except Exception as e:
         # Catch unexpected errors during command sending/processing
-        print(f"Error in send_pdb_command: {e}", file=sys.stderr)
+        logger.error("Error in send_pdb_command: %s", e)
         # Check process status again
-        if pdb_process and pdb_process.poll() is not None:
-             pdb_running = False
+        if session.process and session.process.poll() is not None:
+             session.running = False
              return f"Error sending command: {str(e)}\n\n*** The debugging session has likely ended. ***\n{traceback.format_exc()}"
         else:
              return f"Error sending command: {str(e)}\n{traceback.format_exc()}"
 
 
-@mcp.tool()
+@pdb_tool
 def set_breakpoint(file_path: str, line_number: int) -> str:
     """Set a breakpoint at a specific line in a file. Uses relative path if possible.
 
@@ -682,56 +1058,43 @@ def set_breakpoint(file_path: str, line_number: int) -> str:
         file_path: Path to the file (can be relative to project root or absolute).
         line_number: Line number for the breakpoint.
     """
-    global breakpoints, current_project_root
 
-    if not pdb_running:
+    if not session.running:
         return "No active debugging session. Use start_debug first."
-    if not current_project_root:
+    if not session.project_root:
          return "Error: Project root not identified. Cannot reliably set breakpoint."
 
-    abs_file_path = os.path.abspath(os.path.join(current_project_root, file_path)) # Resolve relative to root first
+    abs_file_path = os.path.abspath(os.path.join(session.project_root, file_path)) # Resolve relative to root first
     if not os.path.exists(abs_file_path):
         abs_file_path = os.path.abspath(file_path) # Try absolute directly
         if not os.path.exists(abs_file_path):
              return f"Error: File not found at '{file_path}' (checked relative to project and absolute)."
+    abs_file_path = normalize_path(abs_file_path) # One key per file, however it was spelled
 
     # Use relative path for the breakpoint command if possible
-    try:
-        rel_file_path = os.path.relpath(abs_file_path, current_project_root)
-        if rel_file_path == '.': rel_file_path = os.path.basename(abs_file_path)
-    except ValueError:
-        rel_file_path = abs_file_path # Fallback to absolute
+    rel_file_path = project_relpath(abs_file_path, session.project_root)
 
     # Track breakpoints using the *absolute* path as the key for internal consistency
-    if abs_file_path not in breakpoints:
-        breakpoints[abs_file_path] = {}
-
-    if line_number in breakpoints[abs_file_path]:
+    if (abs_file_path, line_number) in session.breakpoints:
         # Verify with pdb if it's actually set there
         current_bps = send_to_pdb("b")
         if f"{rel_file_path}:{line_number}" in current_bps:
              return f"Breakpoint already exists and is tracked at {abs_file_path}:{line_number}"
         else:
-             print(f"Warning: Breakpoint tracked locally but not found in PDB output for {rel_file_path}:{line_number}. Will attempt to set.")
+             logger.warning("Breakpoint tracked locally but not found in PDB output for %s:%s. Will attempt to set.", rel_file_path, line_number)
 
 
     command = f"b {rel_file_path}:{line_number}"
     response = send_to_pdb(command)
 
-    # More robust verification using pattern matching
-    bp_markers = ["Breakpoint", "at", str(line_number)]
-    if all(marker in response for marker in bp_markers):
-        # Extract breakpoint number from response
-        match = re.search(r"Breakpoint (\d+) at", response)
-        bp_number = match.group(1) if match else None
-
-        # Store both command and breakpoint number
-        breakpoints[abs_file_path][line_number] = {
-            "command": command,
-            "bp_number": bp_number
-        }
+    # Confirmation must name the requested line; the same match yields the breakpoint number
+    set_numbers, outcomes = parse_breakpoint_reply(response)
+    bp_number = set_numbers.get(int(line_number))
+    if bp_number:
+        # Store the breakpoint number, needed to clear it reliably
+        track_breakpoint((abs_file_path, line_number), bp_number)
         return f"Breakpoint #{bp_number} set and tracked:\n{response}"
-    elif "Error" not in response and "multiple files" not in response.lower():
+    elif 'failed' not in outcomes:
          # Maybe pdb didn't confirm explicitly but didn't error? (e.g., line doesn't exist yet)
          # We won't track it reliably unless PDB confirms it.
          return f"Breakpoint command sent. PDB response might indicate an issue (e.g., invalid line) or success without standard confirmation:\n{response}\n(Breakpoint NOT reliably tracked. Verify with list_breakpoints)"
@@ -740,7 +1103,7 @@ def set_breakpoint(file_path: str, line_number: int) -> str:
         return f"Failed to set breakpoint. PDB response:\n{response}"
 
 
-@mcp.tool()
+@pdb_tool
 def clear_breakpoint(file_path: str, line_number: int) -> str:
     """Clear a breakpoint at a specific line in a file. Uses relative path if possible.
 
@@ -748,36 +1111,26 @@ def clear_breakpoint(file_path: str, line_number: int) -> str:
         file_path: Path to the file where the breakpoint exists.
         line_number: Line number of the breakpoint to clear.
     """
-    global breakpoints, current_project_root
 
-    if not pdb_running:
+    if not session.running:
         return "No active debugging session. Use start_debug first."
-    if not current_project_root:
+    if not session.project_root:
          return "Error: Project root not identified. Cannot reliably clear breakpoint."
 
-    abs_file_path = os.path.abspath(os.path.join(current_project_root, file_path))
+    abs_file_path = os.path.abspath(os.path.join(session.project_root, file_path))
     if not os.path.exists(abs_file_path):
         abs_file_path = os.path.abspath(file_path)
         if not os.path.exists(abs_file_path):
              # If file doesn't exist, we likely don't have a BP anyway
-             if abs_file_path in breakpoints and line_number in breakpoints[abs_file_path]:
-                  del breakpoints[abs_file_path][line_number]
-                  if not breakpoints[abs_file_path]: del breakpoints[abs_file_path]
+             session.breakpoints.pop((normalize_path(abs_file_path), line_number), None)
              return f"Warning: File not found at '{file_path}'. Breakpoint untracked (if it was tracked)."
+    abs_file_path = normalize_path(abs_file_path)
 
-
-    try:
-        rel_file_path = os.path.relpath(abs_file_path, current_project_root)
-        if rel_file_path == '.': rel_file_path = os.path.basename(abs_file_path)
-    except ValueError:
-        rel_file_path = abs_file_path
+    rel_file_path = project_relpath(abs_file_path, session.project_root)
 
     # Check if we have a breakpoint number stored, which is more reliable for clearing
-    bp_number = None
-    if abs_file_path in breakpoints and line_number in breakpoints[abs_file_path]:
-        bp_data = breakpoints[abs_file_path][line_number]
-        if isinstance(bp_data, dict) and "bp_number" in bp_data:
-            bp_number = bp_data["bp_number"]
+    bp_key = (abs_file_path, line_number)
+    bp_number = session.breakpoints.get(bp_key)
 
     # Use the breakpoint number if available, otherwise use file:line
     if bp_number:
@@ -788,14 +1141,14 @@ def clear_breakpoint(file_path: str, line_number: int) -> str:
     response = send_to_pdb(command)
 
     # Check response for confirmation (e.g., "Deleted breakpoint", "No breakpoint")
-    breakpoint_cleared_in_pdb = "Deleted breakpoint" in response or "No breakpoint" in response or "Error: " not in response
+    # Whichever idiom comes first decides; none at all counts as cleared
+    _, outcomes = parse_breakpoint_reply(response)
+    breakpoint_cleared_in_pdb = not outcomes or outcomes[0] != 'failed'
 
     # Update internal tracking
-    if abs_file_path in breakpoints and line_number in breakpoints[abs_file_path]:
+    if bp_key in session.breakpoints:
         if breakpoint_cleared_in_pdb:
-            del breakpoints[abs_file_path][line_number]
-            if not breakpoints[abs_file_path]: # Remove file entry if no more bps
-                 del breakpoints[abs_file_path]
+            del session.breakpoints[bp_key]
             status_msg = "Breakpoint untracked."
         else:
             status_msg = "Breakpoint potentially still exists in PDB despite local tracking. Verify with list_breakpoints."
@@ -806,134 +1159,94 @@ def clear_breakpoint(file_path: str, line_number: int) -> str:
     return f"Clear breakpoint result:\n{response}\n({status_msg})"
 
 
-@mcp.tool()
+@pdb_tool
 def list_breakpoints() -> str:
     """List breakpoints known by PDB and compare with internally tracked breakpoints."""
-    global breakpoints, current_project_root
 
-    if not pdb_running:
+    if not session.running:
         return "No active debugging session. Use start_debug first."
-    if not current_project_root:
+    if not session.project_root:
         # List only tracked BPs if PDB isn't running or root unknown
-        tracked_bps_formatted = []
-        for abs_path, lines in breakpoints.items():
-             # Try to show relative if possible, else absolute
-            try:
-                disp_path = os.path.relpath(abs_path, os.getcwd()) # Relative to current dir might be useful
-            except ValueError:
-                disp_path = abs_path
-            for line_num in sorted(lines.keys()):
-                bp_data = lines[line_num]
-                if isinstance(bp_data, dict) and "bp_number" in bp_data:
-                    tracked_bps_formatted.append(f"{disp_path}:{line_num} (BP #{bp_data['bp_number']})")
-                else:
-                    tracked_bps_formatted.append(f"{disp_path}:{line_num}")
-        return "No active PDB session or project root unknown.\n\n--- Tracked Breakpoints ---\n" + ('\n'.join(tracked_bps_formatted) if tracked_bps_formatted else "None")
+        # Relative to current dir might be useful
+        tracked_bps = '\n'.join(format_tracked_breakpoints(os.getcwd())) or "None"
+        return f"No active PDB session or project root unknown.\n\n--- Tracked Breakpoints ---\n{tracked_bps}"
 
 
     pdb_response = send_to_pdb("b")
 
     # Format our tracked breakpoints using relative paths from project root where possible
-    tracked_bps_formatted = []
-    for abs_path, lines in breakpoints.items():
-        try:
-            rel_path = os.path.relpath(abs_path, current_project_root)
-            if rel_path == '.': rel_path = os.path.basename(abs_path)
-        except ValueError:
-            rel_path = abs_path # Fallback if not relative
-        for line_num in sorted(lines.keys()):
-            bp_data = lines[line_num]
-            if isinstance(bp_data, dict) and "bp_number" in bp_data:
-                tracked_bps_formatted.append(f"{rel_path}:{line_num} (BP #{bp_data['bp_number']})")
-            else:
-                tracked_bps_formatted.append(f"{rel_path}:{line_num}")
-
-    # Add a comparison note
-    comparison_note = "\n(Compare PDB list above with tracked list below. Use set/clear to synchronize if needed.)"
+    tracked_bps = '\n'.join(format_tracked_breakpoints(session.project_root)) or "None"
 
+    # Assembled in one f-string, with a comparison note
     return (f"--- PDB Breakpoints ---\n{pdb_response}\n\n"
-            f"--- Tracked Breakpoints ---\n" +
-            ('\n'.join(tracked_bps_formatted) if tracked_bps_formatted else "None") +
-            comparison_note)
+            f"--- Tracked Breakpoints ---\n{tracked_bps}\n"
+            "(Compare PDB list above with tracked list below. Use set/clear to synchronize if needed.)")
 
-@mcp.tool()
+@pdb_tool
 def restart_debug() -> str:
     """Restart the debugging session with the same file, arguments, and pytest flag."""
-    global pdb_process, pdb_running, current_file, current_args, current_use_pytest
 
-    if not current_file:
+    if not session.file:
         return "No debugging session was previously started (or state lost) to restart."
 
     # Store details before ending the current session
-    file_to_debug = current_file
-    args_to_use = current_args
-    use_pytest_flag = current_use_pytest
-    print(f"Attempting to restart debug for: {file_to_debug} with args='{args_to_use}' pytest={use_pytest_flag}")
+    file_to_debug = session.file
+    args_to_use = session.args
+    use_pytest_flag = session.use_pytest
+    logger.debug("Attempting to restart debug for: %s with args='%s' pytest=%s", file_to_debug, args_to_use, use_pytest_flag)
 
     # End the current session forcefully if running
     end_result = "Previous session not running or already ended."
-    if pdb_running:
-        print("Ending current session before restart...")
+    if session.running:
+        logger.debug("Ending current session before restart...")
         end_result = end_debug() # Use the dedicated end function
-        print(f"Restart: {end_result}")
+        logger.debug("Restart: %s", end_result)
 
     # Reset state explicitly (end_debug should handle most, but belt-and-suspenders)
-    pdb_process = None
-    pdb_running = False
-    # output_thread should be handled by new start_debug call
-
-    # Clear the output queue again just in case
-    while not pdb_output_queue.empty():
-       try: pdb_output_queue.get_nowait()
-       except queue.Empty: break
+    session.process = None
+    session.stdin_fd = None
+    session.running = False
+    # session.output_thread should be handled by new start_debug call
 
     # Start a new session using stored parameters
-    print("Calling start_debug for restart...")
+    logger.debug("Calling start_debug for restart...")
     start_result = start_debug(file_path=file_to_debug, use_pytest=use_pytest_flag, args=args_to_use)
 
-    # Note: Breakpoints are now restored within start_debug using the tracked 'breakpoints' dict
+    # Note: Breakpoints are now restored within start_debug using the tracked 'session.breakpoints' dict
 
     return f"--- Restart Attempt ---\nPrevious session end result: {end_result}\n\nNew session status:\n{start_result}"
 
 
-@mcp.tool()
+@pdb_tool
 def examine_variable(variable_name: str) -> str:
     """Examine a variable's type, value (print), and attributes (dir) using PDB.
 
     Args:
         variable_name: Name of the variable to examine (e.g., 'my_var', 'self.data').
     """
-    if not pdb_running:
+    if not session.running:
         return "No active debugging session. Use start_debug first."
 
-    # Basic print
-    p_command = f"p {variable_name}"
-    print(f"Sending command: {p_command}")
-    basic_info = send_to_pdb(p_command)
-    if not pdb_running: return f"Session ended after 'p {variable_name}'. Output:\n{basic_info}"
-
-    # Type info
-    type_command = f"p type({variable_name})"
-    print(f"Sending command: {type_command}")
-    type_info = send_to_pdb(type_command)
-    # Check if session ended, but proceed if possible
-    if not pdb_running and "Session ended" not in basic_info :
-        return f"Value:\n{basic_info}\n\nSession ended after 'p type({variable_name})'. Type Output:\n{type_info}"
-
-    # Attributes/methods using dir(), protect with try-except in PDB
-    dir_command = f"import inspect; print(dir({variable_name}))" # More robust than just dir()
-    print("Sending command: (inspect dir)")
-    dir_info = send_to_pdb(dir_command)
-    if not pdb_running and "Session ended" not in type_info :
-         return f"Value:\n{basic_info}\n\nType:\n{type_info}\n\nSession ended after 'dir()'. Dir Output:\n{dir_info}"
-
-    # Pretty print (useful for complex objects)
-    pp_command = f"pp {variable_name}"
-    print(f"Sending command: {pp_command}")
-    pretty_info = send_to_pdb(pp_command)
-    if not pdb_running and "Session ended" not in dir_info :
-         return f"Value:\n{basic_info}\n\nType:\n{type_info}\n\nAttributes/Methods:\n{dir_info}\n\nSession ended after 'pp'. PP Output:\n{pretty_info}"
-
+    # Collect value, type, pretty value and attributes in a single round-trip.
+    # The '!' statement runs in the debugged frame; the expression is evaluated once,
+    # as the lambda's argument, and __import__ avoids binding names there.
+    examine_command = (f"!(lambda v: print({EXAMINE_SEPARATOR!r}.join((repr(v), repr(type(v)), "
+                       f"__import__('pprint').pformat(v), repr(dir(v))))))({variable_name})")
+    logger.debug("Sending command: (examine %s)", variable_name)
+    response = send_to_pdb(examine_command)
+    if not session.running:
+        return f"Session ended while examining '{variable_name}'. Output:\n{response}"
+
+    # Drop the trailing prompt line, then split the printed fields apart
+    body = response.removesuffix("(Pdb)").rstrip('\n')
+    fields = body.split(EXAMINE_SEPARATOR)
+    if len(fields) != 4:
+        # Evaluation failed inside pdb (e.g. NameError); show pdb's own error message
+        return (f"--- Variable Examination: {variable_name} ---\n\n"
+                f"Error evaluating '{variable_name}':\n{response}\n"
+                f"--- End Examination ---")
+
+    basic_info, type_info, pretty_info, dir_info = fields
     return (f"--- Variable Examination: {variable_name} ---\n\n"
             f"Value (p):\n{basic_info}\n\n"
             f"Pretty Value (pp):\n{pretty_info}\n\n"
@@ -942,151 +1255,113 @@ def examine_variable(variable_name: str) -> str:
             f"--- End Examination ---")
 
 
-@mcp.tool()
+@pdb_tool
 def get_debug_status() -> str:
     """Get the current status of the debugging session and tracked state."""
-    global pdb_running, current_file, current_project_root, breakpoints, pdb_process
 
-    if not pdb_running:
+    if not session.running:
          # Check if process exists but isn't running
-         if pdb_process and pdb_process.poll() is not None:
+         if session.process and session.process.poll() is not None:
               return "Debugging session ended. Process terminated."
          return "No active debugging session."
 
-    # Check process liveness again
-    if pdb_process and pdb_process.poll() is not None:
-        pdb_running = False
+    # The reader sets output_eof once pdb closes its stdout, so liveness costs no waitpid here
+    if session.output_eof.is_set():
+        session.running = False
         return "Debugging session has ended (process terminated)."
 
     # Format tracked breakpoints for status
-    bp_list = []
-    for abs_path, lines in breakpoints.items():
-         try:
-             rel_path = os.path.relpath(abs_path, current_project_root or os.getcwd())
-             if rel_path == '.': rel_path = os.path.basename(abs_path)
-         except ValueError:
-             rel_path = abs_path
-         for line_num in sorted(lines.keys()):
-            bp_data = lines[line_num]
-            if isinstance(bp_data, dict) and "bp_number" in bp_data:
-                bp_list.append(f"{rel_path}:{line_num} (BP #{bp_data['bp_number']})")
-            else:
-                bp_list.append(f"{rel_path}:{line_num}")
-
-    status = {
-        "running": pdb_running,
-        "current_file": current_file,
-        "project_root": current_project_root,
-        "use_pytest": current_use_pytest,
-        "arguments": current_args,
-        "process_id": pdb_process.pid if pdb_process else None,
-        "tracked_breakpoints": bp_list,
-    }
+    bp_list = format_tracked_breakpoints(session.project_root or os.getcwd())
+    process_id = session.process.pid if session.process else None
 
     # Try to get current location from PDB without advancing
     current_loc_output = "[Could not query PDB location]"
-    if pdb_running and pdb_process and pdb_process.poll() is None:
+    if session.process:
          current_loc_output = send_to_pdb("l .") # Get location without changing state
-         if not pdb_running: # Check if the query itself ended the session
-             status["running"] = False
+         if not session.running: # Check if the query itself ended the session
              current_loc_output += "\n -- Session ended during status check --"
 
+    return ("--- Debug Session Status ---\n"
+            f"Running: {session.running}\n"
+            f"PID: {process_id}\n"
+            f"Project Root: {session.project_root}\n"
+            f"Debugging File: {session.file}\n"
+            f"Using Pytest: {session.use_pytest}\n"
+            f"Arguments: '{session.args}'\n"
+            f"Tracked Breakpoints: {bp_list or 'None'}\n\n"
+            f"-- Current PDB Location --\n{current_loc_output}\n"
+            "--- End Status ---")
 
-    return "--- Debug Session Status ---\n" + \
-           f"Running: {status['running']}\n" + \
-           f"PID: {status['process_id']}\n" + \
-           f"Project Root: {status['project_root']}\n" + \
-           f"Debugging File: {status['current_file']}\n" + \
-           f"Using Pytest: {status['use_pytest']}\n" + \
-           f"Arguments: '{status['arguments']}'\n" + \
-           f"Tracked Breakpoints: {status['tracked_breakpoints'] or 'None'}\n\n" + \
-           f"-- Current PDB Location --\n{current_loc_output}\n" + \
-           "--- End Status ---"
 
-
-@mcp.tool()
+@pdb_tool
 def end_debug() -> str:
     """End the current debugging session forcefully."""
-    global pdb_process, pdb_running, output_thread
 
-    if not pdb_running and (pdb_process is None or pdb_process.poll() is not None):
+    if not session.running and (session.process is None or session.process.poll() is not None):
         return "No active debugging session to end."
 
-    print("Ending debugging session...")
+    logger.debug("Ending debugging session...")
     result_message = "Debugging session ended."
 
-    if pdb_process and pdb_process.poll() is None:
+    if session.process and session.process.poll() is None:
+        process = session.process
         try:
-            # Try sending SIGINT (Ctrl+C) first for cleaner exit
-            if sys.platform != "win32":
+            # One deadline covers the whole graceful exit. 'q' goes first: a SIGINT that lands while
+            # pdb waits at its prompt makes it drop the pending input, 'q' included.
+            deadline = time.monotonic() + GRACEFUL_EXIT_TIMEOUT
+            try:
+                logger.debug("Attempting graceful exit with 'q'...")
+                write_to_pdb('q\n')
+            except OSError as e:
+                logger.warning("Sending 'q' failed (%s).", e)
+            # Still running the program: Ctrl+C stops it at a prompt, which then reads the queued 'q'
+            if not wait_for_exit(process, GRACEFUL_EXIT_TIMEOUT / 4) and sys.platform != "win32":
                 try:
-                    os.kill(pdb_process.pid, signal.SIGINT)
-                    try:
-                        pdb_process.wait(timeout=0.5)
-                    except subprocess.TimeoutExpired:
-                        pass
+                    os.kill(process.pid, signal.SIGINT)
                 except (OSError, ProcessLookupError) as e:
-                    print(f"SIGINT failed: {e}")
-
-            # Next try sending quit command for graceful exit
-            if pdb_process.poll() is None:
-                try:
-                    print("Attempting graceful exit with 'q'...")
-                    pdb_process.stdin.write(b'q\n')
-                    pdb_process.stdin.flush()
-                    # Wait briefly for potential cleanup
-                    pdb_process.wait(timeout=0.5)
-                    print("PDB process quit gracefully.")
-                except (subprocess.TimeoutExpired, OSError, BrokenPipeError) as e:
-                    print(f"Graceful quit failed or timed out ({e}). Terminating forcefully.")
-
-            # If still running, terminate forcefully
-            if pdb_process.poll() is None:
+                    logger.warning("SIGINT failed: %s", e)
+            if wait_for_exit(process, max(0.0, deadline - time.monotonic())):
+                logger.debug("PDB process quit gracefully.")
+            else:
+                logger.warning("Graceful quit timed out. Terminating forcefully.")
                 try:
-                    pdb_process.terminate() # Send SIGTERM
-                    pdb_process.wait(timeout=1.0) # Wait for termination
-                    print("PDB process terminated.")
-                except subprocess.TimeoutExpired:
-                    print("Terminate timed out. Killing process.")
-                    pdb_process.kill() # Send SIGKILL
-                    pdb_process.wait(timeout=0.5) # Wait for kill
-                    print("PDB process killed.")
+                    terminate_process(process, timeout=0.5)
                 except Exception as term_err:
-                     print(f"Error during terminate/kill: {term_err}", file=sys.stderr)
+                     logger.error("Error during terminate/kill: %s", term_err)
                      result_message = f"Debugging session ended with errors during termination: {term_err}"
         except Exception as e:
-            print(f"Error during end_debug: {e}", file=sys.stderr)
+            logger.error("Error during end_debug: %s", e)
             result_message = f"Debugging session ended with errors: {e}"
 
     # Clean up state
-    pdb_process = None
-    pdb_running = False
+    session.process = None
+    session.stdin_fd = None
+    session.running = False
 
-    # Wait briefly for the output thread to potentially finish reading remaining output
-    if output_thread and output_thread.is_alive():
-         print("Waiting for output thread to finish...")
-         output_thread.join(timeout=0.5)
-         if output_thread.is_alive():
-              print("Warning: Output thread did not finish cleanly.", file=sys.stderr)
+    # Let the reader drain what is left, then stop even if a child still holds the pipe
+    stop_output_reader()
+    if session.output_thread and session.output_thread.is_alive():
+         logger.debug("Waiting for output thread to finish...")
+         session.output_thread.join(timeout=0.5)
+         if session.output_thread.is_alive():
+              logger.warning("Output thread did not finish cleanly.")
 
-    output_thread = None # Clear thread object reference
+    session.output_thread = None # Clear thread object reference
 
-    # Clear the queue one last time
-    while not pdb_output_queue.empty():
-        try: pdb_output_queue.get_nowait()
-        except queue.Empty: break
+    # Clear the output buffer one last time
+    session.output_blocks.clear()
 
     # No cleanup needed for pytest debugging flags approach
 
-    print("Debugging session ended and state cleared.")
+    logger.debug("Debugging session ended and state cleared.")
     return result_message
 
 # --- Cleanup on Exit ---
 
 def cleanup():
     """Ensure the PDB process is terminated when the MCP server exits."""
-    print("Running atexit cleanup...")
-    if pdb_running or (pdb_process and pdb_process.poll() is None):
+    logger.debug("Running atexit cleanup...")
+    if session.running or (session.process and session.process.poll() is None):
         end_debug()
 
 atexit.register(cleanup)
@@ -1095,12 +1370,12 @@ atexit.register(cleanup)
 
 def main():
     """Initialize and run the FastMCP server."""
-    print("--- Starting MCP PDB Tool Server ---")
-    print(f"Python Executable: {sys.executable}")
-    print(f"Working Directory: {os.getcwd()}")
+    logger.info("--- Starting MCP PDB Tool Server ---")
+    logger.info("Python Executable: %s", sys.executable)
+    logger.info("Working Directory: %s", os.getcwd())
     # Add any other relevant startup info here
     mcp.run()
-    print("--- MCP PDB Tool Server Shutdown ---")
+    logger.info("--- MCP PDB Tool Server Shutdown ---")
 
 if __name__ == "__main__":
     main()